@@ -2,11 +2,18 @@ import streamlit as st
 import pandas as pd
 import json
 from sqlalchemy import create_engine, text
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
+from openpyxl import Workbook
+import csv
+import os
+import tempfile
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 from geopy.distance import geodesic
 from collections import Counter
+from contextlib import closing
 import pydeck as pdk
+from upload_pipeline import verwerk_upload
 
 ## ─── LOGIN ───────────────────────────────────────
 if "authenticated" not in st.session_state:
@@ -81,6 +88,16 @@ def get_df_containers():
         WHERE datum_ingelezen >= current_date
     """)
 
+@st.cache_data(ttl=300)
+def get_export_content_types():
+    # Ook historische fracties uit het logboek, niet alleen die van vandaag
+    df = run_query("""
+        SELECT content_type FROM apb_containers
+        UNION
+        SELECT content_type FROM apb_logboek_afvalcontainers
+    """)
+    return sorted(df["content_type"].dropna().unique())
+
 def run_query(query, params=None):
     with get_engine().connect() as conn:
         return pd.read_sql(text(query), conn, params=params)
@@ -89,6 +106,15 @@ def execute_query(query, params=None):
     with get_engine().begin() as conn:
         conn.execute(text(query), params or {})
 
+def stream_query(query, params=None, chunksize=5000):
+    # Server-side cursor: Postgres levert de rijen in blokken van `chunksize`,
+    # zodat er nooit de volledige resultaatset in het geheugen staat.
+    with get_engine().connect() as conn:
+        result = conn.execution_options(yield_per=chunksize).execute(text(query), params or {})
+        yield list(result.keys())
+        for rows in result.partitions():
+            yield rows
+
 # ─── PAGINA INSTELLINGEN ────────────────────────
 st.set_page_config(page_title="Afvalcontainerbeheer", layout="wide")
 st.title("♻️ Afvalcontainerbeheer Dashboard")
@@ -246,73 +272,22 @@ with st.sidebar:
             try:
                 st.cache_data.clear()
                 df1 = pd.read_excel(file1)
-                rename_map = {
-                    "Operationele status": "Operational state",
-                    "Containernaam": "Container name",
-                    "Containertype": "Container type",
-                    "Adres": "Address",
-                    "Plaats": "City",
-                    "Locatiecode": "Location code",
-                    "Groep": "Group",
-                    "Inhoudstype": "Content type",
-                    "Vulgraad (%)": "Fill Level",
-                    "Fill level (%)": "Fill Level",
-                    "Installatietijd": "Install time",
-                    "Container locatie": "Container location",
-                    "Externe groeps-ID": "External group ID",
-                    "Device locatie": "Device location"
-                }
-                df1.rename(columns=rename_map, inplace=True)
-                df1.columns = df1.columns.str.strip().str.lower().str.replace(" ", "_")
                 df2 = pd.read_excel(file2)
-                rename_map2 = {
-                    "Route Omschriving": "Route Omschrijving"
-                }
-                df2.rename(columns=rename_map2, inplace=True)
-
-                df1['operational_state'] = df1['operational_state'].astype(str).str.strip().str.lower()
-                df1 = df1[
-                    (df1['operational_state'].isin(['in use', 'in gebruik', 'issue detected'])) &
-                    (df1['status'].str.strip().str.lower() == 'in use') &
-                    (df1['on_hold'].str.strip().str.lower() == 'no')
-                ].copy()
-
-                df1["content_type"] = df1["content_type"].apply(
-                    lambda x: "Glas" if "glass" in str(x).lower() else x
-                )
-                df1["combinatietelling"] = df1.groupby(
-                    ["location_code", "content_type"]
-                )["content_type"].transform("count")
-                df1["gemiddeldevulgraad"] = df1.groupby(
-                    ["location_code", "content_type"]
-                )["fill_level"].transform("mean")
-                df1["oproute"] = df1["container_name"].isin(df2["Omschrijving"]).map({True: "Ja", False: "Nee"})
-                df1["extra_meegegeven"] = False
-
-                cols = [
-                    "container_name", "address", "city", "location_code", "content_type",
-                    "fill_level", "container_location", "combinatietelling",
-                    "gemiddeldevulgraad", "oproute", "extra_meegegeven"
-                ]
-                df1 = df1[cols]
-                df1["datum_ingelezen"] = datetime.now().date()
+                df1, df2, stappen = verwerk_upload(df1, df2)
 
                 engine = get_engine()
                 with engine.begin() as conn:
                     conn.execute(text("TRUNCATE TABLE apb_containers RESTART IDENTITY"))
                 df1.to_sql("apb_containers", engine, if_exists="append", index=False)
 
-                df2 = df2.rename(columns={
-                    "Route Omschrijving": "route_omschrijving",
-                    "Omschrijving": "omschrijving",
-                    "Datum": "datum"
-                })[["route_omschrijving", "omschrijving", "datum"]].drop_duplicates()
                 with engine.begin() as conn:
                     conn.execute(text("TRUNCATE TABLE apb_routes RESTART IDENTITY"))
                 df2.to_sql("apb_routes", engine, if_exists="append", index=False)
 
                 st.session_state.refresh_needed = True
                 st.success("✅ Gegevens succesvol geüpload en cache vernieuwd.")
+                with st.expander("⏱️ Verwerkingstijden"):
+                    st.dataframe(stappen, use_container_width=True, hide_index=True)
             except Exception as e:
                 st.error(f"❌ Fout bij verwerken van bestanden: {e}")
 
@@ -692,3 +667,162 @@ if not df_hand.empty:
     )
 else:
     st.info("📋 Nog geen containers geselecteerd. Alleen routes worden getoond.")
+
+# ─── EXPORT ──────────────────────────────────────
+# Per bron: basisquery, sortering en de kolommen waarop gefilterd kan worden
+# (None = filter niet van toepassing op deze bron).
+EXPORT_BRONNEN = {
+    "Containers": {
+        "query": """
+            SELECT container_name, address, city, location_code, content_type,
+                   fill_level, container_location, combinatietelling,
+                   gemiddeldevulgraad, oproute, extra_meegegeven, datum_ingelezen
+            FROM apb_containers
+        """,
+        "order": "container_name",
+        "datum": "datum_ingelezen",
+        "vestiging": None,
+        "content_type": "content_type",
+    },
+    "Routes": {
+        "query": """
+            SELECT r.route_omschrijving, r.omschrijving AS container_name, r.datum,
+                   c.content_type, c.address, c.city
+            FROM apb_routes r
+            LEFT JOIN apb_containers c ON r.omschrijving = c.container_name
+        """,
+        "order": "r.datum, r.route_omschrijving",
+        "datum": "r.datum",
+        "vestiging": None,
+        "content_type": "c.content_type",
+    },
+    "Logboek": {
+        "query": """
+            SELECT container_name, address, city, location_code, content_type,
+                   fill_level, datum, gebruiker, login_user
+            FROM apb_logboek_afvalcontainers
+        """,
+        "order": "datum",
+        "datum": "datum",
+        "vestiging": "gebruiker",
+        "content_type": "content_type",
+    },
+}
+
+# Maximale bestandsgrootte die via st.download_button wordt aangeboden
+EXPORT_MAX_MB = 200
+
+def bouw_export_query(bron, van, tot, vestigingen, content_types):
+    spec = EXPORT_BRONNEN[bron]
+    # Bereik op de kale kolom (geen ::date cast), zodat een index op datum bruikbaar blijft
+    voorwaarden = [f"{spec['datum']} >= :van AND {spec['datum']} < :tot_plus_1"]
+    params = {"van": van, "tot_plus_1": tot + timedelta(days=1)}
+    if vestigingen and spec["vestiging"]:
+        voorwaarden.append(f"{spec['vestiging']} = ANY(:vestigingen)")
+        params["vestigingen"] = list(vestigingen)
+    if content_types and spec["content_type"]:
+        voorwaarden.append(f"{spec['content_type']} = ANY(:content_types)")
+        params["content_types"] = list(content_types)
+    query = f"{spec['query']} WHERE {' AND '.join(voorwaarden)} ORDER BY {spec['order']}"
+    return query, params
+
+def csv_waarde(v):
+    # NL Excel verwacht een decimale komma; bool is een int, dus die overslaan
+    if isinstance(v, (float, Decimal)) and not isinstance(v, bool):
+        return str(v).replace(".", ",")
+    return v
+
+def schrijf_csv(chunks, pad):
+    aantal = 0
+    # utf-8-sig, ';' als scheidingsteken en decimale komma voor Excel (NL)
+    with open(pad, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(next(chunks))
+        for rows in chunks:
+            writer.writerows([csv_waarde(v) for v in row] for row in rows)
+            aantal += len(rows)
+    return aantal
+
+def excel_waarde(v):
+    # openpyxl kan geen tijdzone-bewuste datetimes wegschrijven
+    if isinstance(v, datetime) and v.tzinfo is not None:
+        return v.replace(tzinfo=None)
+    return v
+
+def schrijf_xlsx(chunks, pad, titel):
+    aantal = 0
+    # Write-only modus: rijen gaan direct naar schijf i.p.v. in een werkblad in geheugen
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titel)
+    ws.append(next(chunks))
+    for rows in chunks:
+        for row in rows:
+            ws.append([excel_waarde(v) for v in row])
+        aantal += len(rows)
+    wb.save(pad)
+    return aantal
+
+st.header("📥 Export")
+with st.expander("Exporteer containers, routes of logboek"):
+    vandaag = datetime.now().date()
+    with st.form("export_form"):
+        bron = st.selectbox("Bron", list(EXPORT_BRONNEN), key="export_bron")
+        periode = st.date_input(
+            "Periode", value=(vandaag - timedelta(days=30), vandaag), key="export_periode"
+        )
+        exp_vestigingen = st.multiselect(
+            "Vestiging (alleen logboek)", ["Delft", "Den Haag"], key="export_vestigingen"
+        )
+        try:
+            export_types = get_export_content_types()
+        except Exception as e:
+            st.error(f"❌ Fout bij ophalen van content types: {e}")
+            export_types = []
+        exp_types = st.multiselect("Content type", export_types, key="export_types")
+        formaat = st.radio("Formaat", ["CSV", "XLSX"], horizontal=True, key="export_formaat")
+        st.caption("💡 Kies XLSX voor verder rekenen met vulgraden; CSV is bedoeld voor NL Excel.")
+        genereer = st.form_submit_button("📦 Genereer export")
+
+    if genereer:
+        if len(periode) != 2:
+            st.warning("⚠️ Kies een begin- én einddatum.")
+        else:
+            van, tot = periode
+            query, params = bouw_export_query(bron, van, tot, exp_vestigingen, exp_types)
+            suffix = ".csv" if formaat == "CSV" else ".xlsx"
+            mime = (
+                "text/csv" if formaat == "CSV"
+                else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+            fd, pad = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            try:
+                with st.spinner("⏳ Export wordt aangemaakt..."):
+                    # closing(): ook bij een fout in de writer de cursor en verbinding vrijgeven
+                    with closing(stream_query(query, params)) as chunks:
+                        if formaat == "CSV":
+                            aantal = schrijf_csv(chunks, pad)
+                        else:
+                            aantal = schrijf_xlsx(chunks, pad, bron)
+                # Het opbouwen gebeurt in blokken, maar st.download_button leest het
+                # complete bestand in het geheugen van Streamlit. Daarom een limiet.
+                grootte_mb = os.path.getsize(pad) / (1024 * 1024)
+                if grootte_mb > EXPORT_MAX_MB:
+                    st.warning(
+                        f"⚠️ Export is {grootte_mb:.0f} MB ({aantal} rijen), meer dan de limiet "
+                        f"van {EXPORT_MAX_MB} MB. Kies een kortere periode of extra filters."
+                    )
+                else:
+                    with open(pad, "rb") as f:
+                        st.download_button(
+                            "⬇️ Download export",
+                            data=f,
+                            file_name=f"{bron.lower()}_{van:%Y%m%d}_{tot:%Y%m%d}{suffix}",
+                            mime=mime,
+                            key="btn_download_export",
+                        )
+                    st.success(f"✅ {aantal} rijen geëxporteerd ({grootte_mb:.1f} MB).")
+            except Exception as e:
+                st.error(f"❌ Fout bij exporteren: {e}")
+            finally:
+                os.remove(pad)
@@ -0,0 +1,121 @@
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# ─── KOLOMNAMEN ──────────────────────────────────
+RENAME_ABEL = {
+    "Operationele status": "Operational state",
+    "Containernaam": "Container name",
+    "Containertype": "Container type",
+    "Adres": "Address",
+    "Plaats": "City",
+    "Locatiecode": "Location code",
+    "Groep": "Group",
+    "Inhoudstype": "Content type",
+    "Vulgraad (%)": "Fill Level",
+    "Fill level (%)": "Fill Level",
+    "Installatietijd": "Install time",
+    "Container locatie": "Container location",
+    "Externe groeps-ID": "External group ID",
+    "Device locatie": "Device location"
+}
+
+RENAME_PIETERBAS = {
+    "Route Omschriving": "Route Omschrijving"
+}
+
+CONTAINER_KOLOMMEN = [
+    "container_name", "address", "city", "location_code", "content_type",
+    "fill_level", "container_location", "combinatietelling",
+    "gemiddeldevulgraad", "oproute", "extra_meegegeven"
+]
+
+GROEP = ["location_code", "content_type"]
+
+
+# ─── HULPFUNCTIES ────────────────────────────────
+def normaliseer(series):
+    # strip/lower alleen op de unieke waarden (categorieën) i.p.v. op elke rij
+    cat = series.astype("category")
+    mapping = {c: str(c).strip().lower() for c in cat.cat.categories}
+    return cat.map(mapping)
+
+
+def vervang_glas(series):
+    # Bepaal per unieke waarde of het glas is, en vervang daarna in één keer
+    uniek = pd.Series(series.dropna().unique())
+    glas = uniek[uniek.astype(str).str.lower().str.contains("glass", regex=False)]
+    return series.mask(series.isin(glas), "Glas")
+
+
+# ─── PIPELINE ────────────────────────────────────
+def verwerk_upload(df1, df2, datum=None):
+    """Zet de ruwe Abel- (df1) en Pieterbas-export (df2) om naar de rijen voor
+    apb_containers en apb_routes.
+
+    Geeft (df_containers, df_routes, stappen) terug; `stappen` bevat per stap
+    het aantal rijen en de doorlooptijd in seconden.
+    """
+    stappen = []
+
+    def meet(stap, start, df):
+        stappen.append({
+            "stap": stap,
+            "rijen": len(df),
+            "seconden": round(time.perf_counter() - start, 4),
+        })
+
+    # 1) Kolomnamen gelijktrekken
+    start = time.perf_counter()
+    df1 = df1.rename(columns=RENAME_ABEL)
+    df1.columns = df1.columns.str.strip().str.lower().str.replace(" ", "_")
+    df2 = df2.rename(columns=RENAME_PIETERBAS)
+    meet("kolommen", start, df1)
+
+    # 2) Alleen containers die in gebruik zijn, in één masker
+    start = time.perf_counter()
+    masker = (
+        normaliseer(df1["operational_state"]).isin(["in use", "in gebruik", "issue detected"])
+        & (normaliseer(df1["status"]) == "in use")
+        & (normaliseer(df1["on_hold"]) == "no")
+    )
+    df1 = df1.loc[masker.to_numpy(dtype=bool), [
+        "container_name", "address", "city", "location_code",
+        "content_type", "fill_level", "container_location"
+    ]].copy()
+    meet("filter", start, df1)
+
+    # 3) Content type: alle glassoorten samen als "Glas"
+    start = time.perf_counter()
+    df1["content_type"] = vervang_glas(df1["content_type"])
+    meet("content_type", start, df1)
+
+    # 4) Aantal en gemiddelde vulgraad per locatie/fractie in één groepering
+    start = time.perf_counter()
+    per_groep = df1.groupby(GROEP, sort=False)["fill_level"].agg(
+        combinatietelling="size", gemiddeldevulgraad="mean"
+    )
+    df1 = df1.join(per_groep, on=GROEP)
+    meet("groepering", start, df1)
+
+    # 5) Op route: opzoeken in een vooraf opgebouwde set containernamen
+    start = time.perf_counter()
+    op_route = set(df2["Omschrijving"].dropna())
+    df1["oproute"] = np.where(df1["container_name"].isin(op_route), "Ja", "Nee")
+    df1["extra_meegegeven"] = False
+    df1 = df1[CONTAINER_KOLOMMEN]
+    df1["datum_ingelezen"] = datum or datetime.now().date()
+    meet("oproute", start, df1)
+
+    # 6) Routes
+    start = time.perf_counter()
+    df2 = df2.rename(columns={
+        "Route Omschrijving": "route_omschrijving",
+        "Omschrijving": "omschrijving",
+        "Datum": "datum"
+    })[["route_omschrijving", "omschrijving", "datum"]].drop_duplicates()
+    meet("routes", start, df2)
+
+    return df1, df2, pd.DataFrame(stappen)